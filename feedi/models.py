@@ -19,6 +19,9 @@ from feedi import scraping
 
 db = SQLAlchemy()
 
+# the maximum amount of bound parameters allowed in a single sqlite statement (as of sqlite 3.32)
+SQLITE_MAX_VARIABLES = 32766
+
 
 logger = logging.getLogger(__name__)
 
@@ -191,6 +194,9 @@ class Feed(db.Model):
 
     folder = sa.Column(sa.String, index=True)
 
+    frequency_rank = sa.Column(sa.Integer, doc="The bucket this feed falls into according to how frequently it \
+                               gets new entries. Recomputed after syncing, see `frequency_rank_query`.")
+
     __mapper_args__ = {'polymorphic_on': type,
                        'polymorphic_identity': 'feed'}
 
@@ -244,17 +250,39 @@ class Feed(db.Model):
         entries = self.fetch_entry_data(force)
         self.last_fetch = utcnow
 
+        # entries are grouped by the fields they include, since a multi-row insert needs the same
+        # columns for every row, and we don't want to overwrite the fields missing from an entry with nulls
+        batches = {}
         for values in entries:
-            # upsert to handle already seen entries.
             # updated time set explicitly as defaults are not honored in manual on_conflict_do_update
             values['updated'] = utcnow
             values['feed_id'] = self.id
             values['user_id'] = self.user_id
-            db.session.execute(
-                sqlite.insert(Entry).
-                values(**values).
-                on_conflict_do_update(("feed_id", "remote_id"), set_=values)
-            )
+            batches.setdefault(tuple(sorted(values)), []).append(values)
+
+        for columns, rows in batches.items():
+            # upsert to handle already seen entries.
+            # rows are inserted in as few statements as the sqlite bound parameter limit allows
+            batch_size = SQLITE_MAX_VARIABLES // len(columns)
+            for i in range(0, len(rows), batch_size):
+                insert = sqlite.insert(Entry).values(rows[i:i + batch_size])
+                updated_values = {column: insert.excluded[column] for column in columns
+                                  if column not in Entry.UPSERT_IMMUTABLE_COLUMNS}
+
+                # the full content may have been fetched separately (see Entry.fetch_content)
+                # so keep it if the source doesn't provide one
+                if 'content_full' in updated_values:
+                    updated_values['content_full'] = sa.func.coalesce(updated_values['content_full'],
+                                                                      Entry.__table__.c.content_full)
+
+                # only rewrite the row if some of the remote fields actually changed,
+                # so re-syncing an unchanged feed doesn't touch the table or its indexes
+                changed = sa.or_(*[Entry.__table__.c[column].is_distinct_from(value)
+                                   for column, value in updated_values.items()
+                                   if column != 'updated'])
+                db.session.execute(
+                    insert.on_conflict_do_update(("feed_id", "remote_id"),
+                                                 set_=updated_values, where=changed))
 
     def fetch_entry_data(self, _force=False):
         """
@@ -283,30 +311,38 @@ class Feed(db.Model):
         # this expression ranks feeds (puts them in "buckets") according to how much daily entries they have on average
         # NOTE: some of this categories are impossible with a low retention period
         # (e.g. we can't distinguish between weekly and monthly if we only keep 5 days or records)
+        daily_entries = sa.func.count(cls.id) / days_since_creation
         rank_func = sa.case(
-            (sa.func.count(cls.id) / days_since_creation < 1 / 30, 0),  # once a month or less
-            (sa.func.count(cls.id) / days_since_creation < 1 / 7, 1),  # once week or less
-            (sa.func.count(cls.id) / days_since_creation < 1, 2),  # once a day or less
-            (sa.func.count(cls.id) / days_since_creation < 5, 3),  # 5 times a day or less
-            (sa.func.count(cls.id) / days_since_creation < 20, 4),  # 20 times a day or less
+            (daily_entries < 1 / 30, 0),  # once a month or less
+            (daily_entries < 1 / 7, 1),  # once week or less
+            (daily_entries < 1, 2),  # once a day or less
+            (daily_entries < 5, 3),  # 5 times a day or less
+            (daily_entries < 20, 4),  # 20 times a day or less
             else_=5  # more
         )
 
         return db.select(cls.id, rank_func.label('rank'))\
             .join(Entry)\
             .filter(Entry.sort_date >= retention_date)\
-            .group_by(cls)\
+            .group_by(cls.id)\
             .subquery()
 
-    def frequency_rank(self):
+    @classmethod
+    def update_frequency_ranks(cls, feed_id=None):
         """
-        Return the frequency rank of this feed.
+        Recompute the frequency rank of every feed, or just of the one with the given id,
+        and store it in the frequency_rank column.
         """
-        subquery = self.frequency_rank_query()
-        query = db.select(subquery.c.rank)\
-                  .select_from(Feed)\
-                  .join(subquery, subquery.c.id == self.id)
-        return db.session.scalar(query)
+        subquery = cls.frequency_rank_query()
+        rank = db.select(subquery.c.rank)\
+                 .filter(subquery.c.id == cls.id)\
+                 .scalar_subquery()
+
+        # the rank is derived data, so the feed updated timestamp is explicitly left untouched
+        update = db.update(cls).values(frequency_rank=rank, updated=cls.updated)
+        if feed_id:
+            update = update.where(cls.id == feed_id)
+        db.session.execute(update)
 
 
 class RssFeed(Feed):
@@ -415,6 +451,9 @@ class Entry(db.Model):
     "Sort entries based on the post frequency of the parent feed."
     ORDER_FREQUENCY = 'frequency'
 
+    "Columns identifying the entry, which aren't overwritten when re-syncing it from its feed."
+    UPSERT_IMMUTABLE_COLUMNS = ('feed_id', 'remote_id', 'user_id')
+
     __tablename__ = 'entries'
 
     id = sa.Column(sa.Integer, primary_key=True)
@@ -481,7 +520,8 @@ class Entry(db.Model):
         sa.String, doc="To be used for standalone entry avatars or as a fallback when the feed has no icon.")
 
     __table_args__ = (sa.UniqueConstraint("feed_id", "remote_id"),
-                      sa.Index("entry_sort_ts", sort_date.desc()))
+                      sa.Index("entry_sort_ts", sort_date.desc()),
+                      sa.Index("entry_feed_sort_ts", feed_id, sort_date.desc()))
 
     @classmethod
     def from_url(cls, user_id, url):
@@ -538,15 +578,20 @@ class Entry(db.Model):
         Return a base Entry query applying any combination of filters.
         """
 
-        query = db.select(cls).filter_by(user_id=user_id)
+        # the entry templates render the parent feed name and icon, so load it along with
+        # the entries to prevent issuing a separate query for each one of them.
+        # isouter = true so standalone entries (without a feed) are included
+        query = db.select(cls).filter_by(user_id=user_id)\
+                  .join(Feed, isouter=True)\
+                  .options(sa.orm.contains_eager(cls.feed))
 
         if older_than:
             query = query.filter(cls.created < older_than)
 
             if hide_seen:
                 # We use older_than so we don't exclude viewed entries from the current pagination "session"
-                # (those previous entries need to be included for a correct calculation of the limit/offset
-                # next time a page is fetch).
+                # (otherwise the entries of the previous pages would disappear from the listing as soon as
+                # they are marked as viewed).
                 query = query.filter(cls.viewed.is_(None) |
                                      (cls.viewed.isnot(None) & (cls.viewed > older_than)))
 
@@ -589,35 +634,83 @@ class Entry(db.Model):
         Return a query to filter entries added after the `start_at` datetime,
         sorted according to the specified `ordering` criteria and with optional filters.
         """
+        query, sort_key = cls._sorted_query(user_id, ordering, start_at, **filters)
+        return query.order_by(*[column.desc() for column in sort_key])
+
+    @classmethod
+    def select_page(cls, user_id, ordering, start_at, limit, after=None, **filters):
+        """
+        Return a page of up to `limit` entries, added after the `start_at` datetime and sorted according
+        to the specified `ordering`, along with a cursor to pass as `after` to fetch the next page,
+        or None if there are no more entries.
+        The cursor is the tuple of sort values of the last entry in the page, so pages are fetched by
+        comparing against it (keyset pagination) instead of counting and skipping the previous ones.
+        """
+        query, sort_key = cls._sorted_query(user_id, ordering, start_at, **filters)
+        if after:
+            query = query.filter(sa.tuple_(*sort_key) < tuple(after))
+
+        # fetch an extra row to know if there's a next page
+        query = query.add_columns(*sort_key)\
+                     .order_by(*[column.desc() for column in sort_key])\
+                     .limit(limit + 1)
+        rows = db.session.execute(query).all()
+
+        entries = [row[0] for row in rows[:limit]]
+        next_after = tuple(rows[limit - 1][1:]) if len(rows) > limit else None
+        return entries, next_after
+
+    @classmethod
+    def mark_viewed_until(cls, user_id, ordering, start_at, until, **filters):
+        """
+        Set the viewed date of the not yet viewed entries that come before the `until` cursor, as returned by
+        `select_page`, in the given ordering.
+        """
+        query, sort_key = cls._sorted_query(user_id, ordering, start_at, **filters)
+        entry_ids = query.with_only_columns(cls.id)\
+                         .filter(cls.viewed.is_(None),
+                                 sa.tuple_(*sort_key) >= tuple(until))
+
+        update = db.update(cls)\
+                   .where(cls.id.in_(entry_ids))\
+                   .values(viewed=datetime.datetime.utcnow())
+        db.session.execute(update)
+
+    @classmethod
+    def _sorted_query(cls, user_id, ordering, start_at, **filters):
+        """
+        Return the filtered query for the given ordering along with its sort key: the tuple of columns
+        that determine the entries order, all of them to be sorted in descending order.
+        """
         query = cls._filtered_query(user_id, older_than=start_at, **filters)
 
         if filters.get('favorited'):
-            return query.order_by(cls.favorited.desc())
+            sort_key = (cls.favorited,)
 
         elif filters.get('sent_to_kindle'):
-            return query.order_by(cls.sent_to_kindle.desc())
+            sort_key = (cls.sent_to_kindle,)
 
         elif ordering == cls.ORDER_RECENCY:
             # reverse chronological order
-            return query.order_by(cls.sort_date.desc())
+            sort_key = (cls.sort_date,)
 
         elif ordering == cls.ORDER_FREQUENCY:
             # Order entries by least frequent feeds first then reverse-chronologically for entries in the same
             # frequency rank.
-            subquery = Feed.frequency_rank_query()
-
             # exhaust last n hours of all ranks before moving to older stuff
             # if smaller delta, more chances to bury infrequent posts
             # if bigger, more chances to bury recent stuff under old unseen infrequent posts
-            recency_bucket_date = datetime.datetime.utcnow() - datetime.timedelta(hours=24)
-
-            # isouter = true so that if a feed with only old stuff is added, entries still show up
-            # even without having a freq rank
-            return query.join(Feed, isouter=True)\
-                        .join(subquery, Feed.id == subquery.c.id, isouter=True)\
-                        .order_by(
-                            (cls.sort_date >= recency_bucket_date).desc(),
-                            subquery.c.rank,
-                            cls.sort_date.desc())
+            # the bucket is relative to start_at, so it stays the same across pages
+            recency_bucket_date = start_at - datetime.timedelta(hours=24)
+
+            # the rank is negated to sort from least to most frequent in descending order,
+            # and entries without a rank (e.g. a feed with only old stuff) are put first,
+            # as sqlite would sort nulls in ascending order
+            sort_key = ((cls.sort_date >= recency_bucket_date),
+                        -sa.func.coalesce(Feed.frequency_rank, -1),
+                        cls.sort_date)
         else:
             raise ValueError('unknown ordering %s' % ordering)
+
+        # break ties by id so the order is total and no entries are skipped or repeated between pages
+        return query, sort_key + (cls.id,)
@@ -3,11 +3,11 @@ import html
 import json
 import logging
 import pprint
-import time
 import traceback
 import urllib
 
 import feedparser
+import gevent.pool
 from bs4 import BeautifulSoup
 from feedi import scraping
 from feedi.requests import USER_AGENT, requests
@@ -17,13 +17,13 @@ logger = logging.getLogger(__name__)
 
 feedparser.USER_AGENT = USER_AGENT
 
+# how many entries of a feed to parse concurrently
+PARSE_POOL_SIZE = 10
+
 
 def fetch(feed_name, url, skip_older_than, min_amount,
           previous_fetch, etag, modified, filters):
-    parser_cls = RSSParser
-    for cls in RSSParser.__subclasses__():
-        if cls.is_compatible(url):
-            parser_cls = cls
+    parser_cls = RSSParser.resolve(url)
 
     # TODO these arg distribution between constructor and method probably
     # doesn't make sense anymore
@@ -42,7 +42,7 @@ def fetch_icon(url):
 
     # otherwise try to get the icon from an explicit icon link
     icon_url = feed['feed'].get('icon', feed['feed'].get('webfeeds_icon'))
-    if icon_url and requests.get(icon_url).ok:
+    if icon_url and scraping.url_ok(icon_url):
         logger.debug("using feed icon: %s", icon_url)
         return icon_url
 
@@ -59,13 +59,38 @@ class RSSParser(CachingRequestsMixin):
     FIELDS = ['title', 'avatar_url', 'username', 'content_short', 'content_full', 'media_url', 'remote_id',
               'display_date', 'sort_date', 'comments_url', 'target_url', 'content_url', 'header',]
 
+    "To be overridden by subclasses, the domains (including their subdomains) of the feeds they may parse."
+    DOMAINS = []
+
+    # subclasses registered by domain, so only the ones for the feed domain are checked for compatibility
+    _parsers_by_domain = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if not cls.DOMAINS:
+            raise TypeError(f'{cls.__name__} must declare the DOMAINS of the feeds it parses')
+        for domain in cls.DOMAINS:
+            RSSParser._parsers_by_domain.setdefault(domain, []).append(cls)
+
+    @classmethod
+    def resolve(cls, feed_url):
+        "Return the parser class suited to parse the feed at the given url, or the default RSSParser."
+        domain_parts = (urllib.parse.urlparse(feed_url).hostname or '').split('.')
+        # check the url domain and each of its parents, e.g. old.reddit.com then reddit.com
+        for i in range(len(domain_parts) - 1):
+            domain = '.'.join(domain_parts[i:])
+            for parser_cls in cls._parsers_by_domain.get(domain, []):
+                if parser_cls.is_compatible(feed_url):
+                    return parser_cls
+        return cls
+
     @staticmethod
     def is_compatible(_feed_url):
         """
-        To be overridden by subclasses, this method inspects the url to decide if a given parser
-        class is suited to parse the source at the given url.
+        Subclasses are only considered for feeds in their DOMAINS. This method can be overridden
+        to further inspect the url to decide if the parser is suited to parse the source at the given url.
         """
-        raise NotImplementedError
+        return True
 
     def __init__(self, feed_name, url, skip_older_than, min_amount):
         super().__init__()
@@ -74,6 +99,9 @@ class RSSParser(CachingRequestsMixin):
         self.skip_older_than = skip_older_than
         self.min_amount = min_amount
 
+        # parsed summary html of the entries being parsed, by entry id, to reuse it across field parsers
+        self._summary_soups = {}
+
     def fetch(self, previous_fetch, etag, modified, filters=None):
         """
         Requests the RSS/Atom feed and, if it has changed, parses recent entries which
@@ -83,6 +111,11 @@ class RSSParser(CachingRequestsMixin):
         # https://feedparser.readthedocs.io/en/latest/http-etag.html
         feed = feedparser.parse(self.url, etag=etag, modified=modified)
 
+        if feed.get('status') == 304:
+            # keep the previous headers so the next fetch is conditional as well
+            logger.info('skipping unchanged feed %s', self.url)
+            return None, [], etag, modified
+
         if feed.bozo:
             logger.warning("Failure parsing feed %s %s", self.feed_name, feed.bozo_exception)
             # this doesn't necessarily mean the feed was not parsed, so moving on
@@ -94,54 +127,97 @@ class RSSParser(CachingRequestsMixin):
         etag = getattr(feed, 'etag', None)
         modified = getattr(feed, 'modified', None)
 
-        entries = []
+        # discard the entries that can be told apart without parsing them
+        is_first_load = previous_fetch is None
+        recent_items = []
+        old_items = []
         for item in feed['items']:
-
             try:
-                entry = self.parse(item, len(entries), previous_fetch, filters)
-                if entry:
-                    entry['raw_data'] = json.dumps(item)
-                    entries.append(entry)
+                if self.is_candidate(item, is_first_load, filters):
+                    (old_items if self.is_old(item) else recent_items).append(item)
             except Exception as error:
-                exc_desc_lines = traceback.format_exception_only(type(error), error)
-                exc_desc = ''.join(exc_desc_lines).rstrip()
-                logger.error("skipping errored entry %s %s %s",
-                             self.feed_name,
-                             item.get('link'),
-                             exc_desc)
-                logger.debug(traceback.format_exc())
-
+                self._log_entry_error(item, error)
+
+        # the field parsers may need to make requests (e.g. to fetch the article metadata)
+        # so the entries are parsed concurrently
+        pool = gevent.pool.Pool(PARSE_POOL_SIZE)
+        entries_by_item = {}
+        self._parse_into(pool, recent_items, entries_by_item)
+
+        # on first load old entries are parsed, in feed order, only until reaching the minimum amount,
+        # which only counts the entries that were parsed successfully
+        while old_items and len(entries_by_item) < self.min_amount:
+            missing = self.min_amount - len(entries_by_item)
+            self._parse_into(pool, old_items[:missing], entries_by_item)
+            old_items = old_items[missing:]
+
+        entries = [entries_by_item[id(item)] for item in feed['items'] if id(item) in entries_by_item]
         return feed['feed'], entries, etag, modified
 
-    def parse(self, item, parsed_count, previous_fetch, filters):
+    def _parse_into(self, pool, items, entries_by_item):
+        "Parse the given raw entries concurrently, adding the successful ones to `entries_by_item` by item id."
+        for item, entry in zip(items, pool.imap(self._parse_or_skip, items)):
+            if entry:
+                entries_by_item[id(item)] = entry
+
+    def is_candidate(self, item, is_first_load, filters):
         """
-        Pass the given raw entry data to each of the field parsers to produce an
-        entry values dict.
+        Return whether the given raw entry should be parsed. Old entries are only parsed on the
+        first load of the feed, in case they are needed to reach the minimum amount.
         """
         if self.should_skip(item):
-            return
+            return False
 
         # or that's too old
-        is_first_load = previous_fetch is None
-        published = item.get('published_parsed', item.get('updated_parsed'))
-        if (self.skip_older_than and published and to_datetime(published) < self.skip_older_than):
+        if self.is_old(item):
             # unless it's the first time we're loading it, in which case we prefer to show old stuff
             # to showing nothing
-            if not is_first_load or not self.min_amount or parsed_count >= self.min_amount:
+            if not is_first_load or not self.min_amount:
                 logger.debug('skipping old entry %s', item.get('link'))
-                return
+                return False
 
         if filters and not self._matches(item, filters):
             logger.debug('skipping entry not matching filters %s %s', item.get('link'), filters)
-            return
+            return False
 
+        return True
+
+    def is_old(self, item):
+        "Return whether the given raw entry was published before the `skip_older_than` date."
+        published = item.get('published_parsed', item.get('updated_parsed'))
+        return bool(self.skip_older_than and published and to_datetime(published) < self.skip_older_than)
+
+    def parse(self, item):
+        """
+        Pass the given raw entry data to each of the field parsers to produce an
+        entry values dict.
+        """
         result = {}
         for field in self.FIELDS:
             method = 'parse_' + field
             result[field] = getattr(self, method)(item)
 
+        result['raw_data'] = json.dumps(item)
         return result
 
+    def _parse_or_skip(self, item):
+        "Parse the given raw entry, returning None instead of failing if there's an error."
+        try:
+            return self.parse(item)
+        except Exception as error:
+            self._log_entry_error(item, error)
+        finally:
+            self._summary_soups.pop(id(item), None)
+
+    def _log_entry_error(self, item, error):
+        exc_desc_lines = traceback.format_exception_only(type(error), error)
+        exc_desc = ''.join(exc_desc_lines).rstrip()
+        logger.error("skipping errored entry %s %s %s",
+                     self.feed_name,
+                     item.get('link'),
+                     exc_desc)
+        logger.debug(traceback.format_exc())
+
     @staticmethod
     def should_skip(_entry):
         # hook for subclasses to apply ad hoc skipping logic
@@ -165,6 +241,15 @@ class RSSParser(CachingRequestsMixin):
 
         return True
 
+    def summary_soup(self, entry):
+        """
+        Return the entry summary parsed as html. The result is reused by all the field parsers
+        of the same entry, so it shouldn't be modified by callers.
+        """
+        if id(entry) not in self._summary_soups:
+            self._summary_soups[id(entry)] = BeautifulSoup(entry['summary'], 'lxml')
+        return self._summary_soups[id(entry)]
+
     def parse_title(self, entry):
         return entry.get('title') or self.fetch_meta(self.parse_content_url(entry), 'og:title')
 
@@ -193,7 +278,7 @@ class RSSParser(CachingRequestsMixin):
 
     def parse_avatar_url(self, entry):
         url = entry.get('source', {}).get('icon')
-        if url and requests.get(url).ok:
+        if url and scraping.url_ok(url):
             logger.debug('found entry-level avatar %s', url)
             return url
 
@@ -238,7 +323,7 @@ class RSSParser(CachingRequestsMixin):
 
         # else try to extract it from the summary html
         if 'summary' in entry:
-            soup = BeautifulSoup(entry['summary'], 'lxml')
+            soup = self.summary_soup(entry)
             if soup.img:
                 return soup.img['src']
 
@@ -324,8 +409,10 @@ def pretty_print(url):
 
 
 def to_datetime(struct_time):
+    # feedparser already normalizes parsed dates to UTC, so take the fields as is
+    # instead of round-tripping through a (local time) timestamp
     try:
-        return datetime.datetime.fromtimestamp(time.mktime(struct_time))
+        return datetime.datetime(*struct_time[:6])
     except Exception:
         logger.error("Failure in date parsing, received %s", struct_time)
         raise
@@ -344,9 +431,11 @@ feedparser.registerDateHandler(short_date_handler)
 class RedditInboxParser(RSSParser):
     "Parser for message inboxes, see https://www.reddit.com/prefs/feeds/ when logged in."
 
+    DOMAINS = ['reddit.com']
+
     @staticmethod
     def is_compatible(feed_url):
-        return 'reddit.com/message' in feed_url
+        return urllib.parse.urlparse(feed_url).path.startswith('/message')
 
     def parse_content_short(self, entry):
         return entry['content'][0]['value']
@@ -358,12 +447,15 @@ class RedditInboxParser(RSSParser):
 class RedditParser(RSSParser):
     "Parser for public or private reddit listings (i.e. subreddits, user messages, home feed, etc.)"
 
+    DOMAINS = ['reddit.com']
+
     @staticmethod
     def is_compatible(feed_url):
-        # looks like reddit but not like the inbox feed
-        return 'reddit.com' in feed_url and 'reddit.com/message' not in feed_url
+        # any reddit feed but the inbox
+        return not RedditInboxParser.is_compatible(feed_url)
 
     def parse_content_short(self, entry):
+        # parsing a separate copy of the summary since the links are removed below
         soup = BeautifulSoup(entry['summary'], 'lxml')
         link_anchor = soup.find("a", string="[link]")
         comments_anchor = soup.find("a", string="[comments]")
@@ -380,7 +472,7 @@ class RedditParser(RSSParser):
         return self.fetch_meta(link_anchor['href'], 'og:description', 'description')
 
     def parse_content_url(self, entry):
-        soup = BeautifulSoup(entry['summary'], 'lxml')
+        soup = self.summary_soup(entry)
         return soup.find("a", string="[link]")['href']
 
     def parse_comments_url(self, entry):
@@ -397,9 +489,7 @@ class RedditParser(RSSParser):
 
 
 class LobstersParser(RSSParser):
-    @staticmethod
-    def is_compatible(feed_url):
-        return 'lobste.rs' in feed_url
+    DOMAINS = ['lobste.rs']
 
     def parse_content_short(self, entry):
         # fill summary from source for link-only posts
@@ -414,9 +504,7 @@ class LobstersParser(RSSParser):
 
 
 class HackerNewsParser(RSSParser):
-    @staticmethod
-    def is_compatible(feed_url):
-        return 'news.ycombinator.com' in feed_url or 'hnrss.org' in feed_url
+    DOMAINS = ['news.ycombinator.com', 'hnrss.org']
 
     def parse_content_short(self, entry):
         # fill summary from source for link-only posts
@@ -430,9 +518,11 @@ class GithubFeedParser(RSSParser):
     """
     Parser for the personal Github notifications feed.
     """
+    DOMAINS = ['github.com']
+
     @staticmethod
     def is_compatible(feed_url):
-        return 'github.com' in feed_url and 'private.atom' in feed_url
+        return 'private.atom' in feed_url
 
     def parse_content_short(self, entry):
         return entry['title']
@@ -462,9 +552,11 @@ class GoodreadsFeedParser(RSSParser):
     """
     Parser for the Goodreads private home rss feed.
     """
+    DOMAINS = ['goodreads.com']
+
     @staticmethod
     def is_compatible(feed_url):
-        return 'goodreads.com' in feed_url and '/home/index_rss' in feed_url
+        return '/home/index_rss' in feed_url
 
     def parse_content_short(self, entry):
         # some updates come with escaped html entities
@@ -496,9 +588,7 @@ class GoodreadsFeedParser(RSSParser):
 
 
 class RevistaCrisisParser(RSSParser):
-    @staticmethod
-    def is_compatible(feed_url):
-        return 'revistacrisis.com.ar' in feed_url
+    DOMAINS = ['revistacrisis.com.ar']
 
     @staticmethod
     def should_skip(entry):
@@ -509,9 +599,7 @@ class RevistaCrisisParser(RSSParser):
 
 
 class ACMQueueParser(RSSParser):
-    @staticmethod
-    def is_compatible(feed_url):
-        return 'queue.acm.org' in feed_url
+    DOMAINS = ['queue.acm.org']
 
     def parse_content_short(self, entry):
         content = self.request(entry['link'])
@@ -529,23 +617,23 @@ class ACMQueueParser(RSSParser):
 
 
 class WikiFeaturedParser(RSSParser):
+    DOMAINS = ['wikipedia.org']
+
     @staticmethod
     def is_compatible(feed_url):
-        return 'wikipedia.org' in feed_url and 'featuredfeed' in feed_url
+        return 'featuredfeed' in feed_url
 
     def parse_content_short(self, entry):
-        soup = BeautifulSoup(entry['summary'], 'lxml')
+        soup = self.summary_soup(entry)
         return str(soup.find('p'))
 
     def parse_title(self, entry):
-        soup = BeautifulSoup(entry['summary'], 'lxml')
+        soup = self.summary_soup(entry)
         return soup.find('p').find('a').text
 
 
 class IndieBlogParser(RSSParser):
-    @staticmethod
-    def is_compatible(_feed_url):
-        return 'indieblog.page' in _feed_url
+    DOMAINS = ['indieblog.page']
 
     def parse_content_short(self, entry):
         soup = BeautifulSoup(entry['summary'], 'lxml')
@@ -1,12 +1,27 @@
 import functools
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36'
 TIMEOUT_SECONDS = 5
 
+# the session is shared by all concurrent sync tasks, so the pools are sized for keep-alive
+# connections to be reused instead of evicted or discarded.
+# how many per-host pools to keep, roughly the amount of feeds synced at a time (see HUEY_POOL_SIZE)
+POOL_CONNECTIONS = 100
+# how many connections to keep in each per-host pool
+POOL_MAXSIZE = 32
+
 requests = requests.Session()
 requests.headers.update({'User-Agent': USER_AGENT})
 
+# retry transient connection errors, but not error responses
+adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                      max_retries=Retry(total=2, backoff_factor=0.3))
+requests.mount('http://', adapter)
+requests.mount('https://', adapter)
+
 # always use a default timeout
-requests.get = functools.partial(requests.get, timeout=TIMEOUT_SECONDS)
+requests.request = functools.partial(requests.request, timeout=TIMEOUT_SECONDS)
@@ -1,4 +1,6 @@
+import base64
 import datetime
+import json
 
 import flask
 import sqlalchemy as sa
@@ -83,28 +85,42 @@ def fetch_entries_page(page_arg,
     # pagination includes a start at timestamp so the entry set remains the same
     # even if new entries are added between requests
     if page_arg:
-        start_at, page_num = page_arg.split(':')
-        page_num = int(page_num)
-        start_at = datetime.datetime.fromtimestamp(float(start_at))
+        start_at, after = decode_page_cursor(page_arg)
     else:
         start_at = datetime.datetime.utcnow()
-        page_num = 1
+        after = None
 
-    query = models.Entry.sorted_by(user_id, ordering, start_at, **filters)
-    entry_page = db.paginate(query, per_page=app.config['ENTRY_PAGE_SIZE'], page=page_num)
-    next_page = f'{start_at.timestamp()}:{page_num + 1}' if entry_page.has_next else None
+    entries, next_after = models.Entry.select_page(user_id, ordering, start_at,
+                                                   limit=app.config['ENTRY_PAGE_SIZE'],
+                                                   after=after, **filters)
+    next_page = encode_page_cursor(start_at, next_after) if next_after else None
 
-    if entry_page.has_prev:
+    if after:
         # mark the previous page as viewed. The rationale is that the user fetches
         # nth page we can assume the previous one can be marked as viewed.
-        previous_ids = [e.id for e in entry_page.prev().items]
-        update = db.update(models.Entry)\
-            .where(models.Entry.id.in_(previous_ids))\
-            .values(viewed=datetime.datetime.utcnow())
-        db.session.execute(update)
+        models.Entry.mark_viewed_until(user_id, ordering, start_at, after, **filters)
         db.session.commit()
 
-    return entry_page, next_page
+    return entries, next_page
+
+
+def encode_page_cursor(start_at, after):
+    """
+    Encode the pagination start timestamp and the sort values of the last entry of a page
+    as an url-safe string to fetch the next page.
+    """
+    values = [start_at.timestamp()] + [v.isoformat() if isinstance(v, datetime.datetime) else v
+                                       for v in after]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_page_cursor(page_arg):
+    "Return the start_at datetime and entry sort values encoded in the given page string."
+    start_at, *after = json.loads(base64.urlsafe_b64decode(page_arg))
+    # the sort values are either numbers or dates, the latter serialized as strings
+    after = [datetime.datetime.fromisoformat(v) if isinstance(v, str) else v
+             for v in after]
+    return datetime.datetime.fromtimestamp(start_at), after
 
 
 @app.get("/autocomplete")
@@ -256,14 +272,12 @@ def mastodon_boost(id):
 @app.route("/feeds")
 @login_required
 def feed_list():
-    subquery = models.Feed.frequency_rank_query()
-    feeds = db.session.execute(db.select(models.Feed, subquery.c.rank, sa.func.count(1),
+    feeds = db.session.execute(db.select(models.Feed, models.Feed.frequency_rank, sa.func.count(1),
                                          sa.func.max(models.Entry.sort_date).label('updated'))
                                .filter(models.Feed.user_id == current_user.id)
-                               .join(subquery, models.Feed.id == subquery.c.id, isouter=True)
                                .join(models.Entry, models.Feed.id == models.Entry.feed_id, isouter=True)
-                               .group_by(models.Feed)
-                               .order_by(sa.text('rank desc'), sa.text('updated desc')))
+                               .group_by(models.Feed.id)
+                               .order_by(models.Feed.frequency_rank.desc(), sa.text('updated desc')))
 
     return flask.render_template('feeds.html', feeds=feeds)
 
@@ -309,9 +323,9 @@ def feed_add_submit():
         return flask.render_template('feed_edit.html', error_msg='url is required', **values)
 
     name = values.get('name')
-    feed = db.session.scalar(db.select(models.Feed).filter_by(
-        name=name, user_id=current_user.id))
-    if feed:
+    query = db.select(db.exists(models.Feed)
+                      .where(models.Feed.name == name, models.Feed.user_id == current_user.id))
+    if db.session.scalar(query):
         return flask.render_template('feed_edit.html', error_msg=f"A feed with name '{name}' already exists", **values)
 
     feed_cls = models.Feed.resolve(values['type'])
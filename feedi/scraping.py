@@ -2,6 +2,7 @@ import io
 import json
 import logging
 import subprocess
+import time
 import urllib
 import zipfile
 
@@ -23,14 +24,66 @@ def get_favicon(url, html=None):
 
     try:
         if not html:
-            favicons = favicon.get(url, headers={'User-Agent': USER_AGENT}, timeout=2)
-        else:
-            favicons = sorted(favicon.tags(url, html),
-                              key=lambda i: i.width + i.height, reverse=True)
+            return fetch_site_favicon(url)
+
+        favicons = sorted(favicon.tags(url, html),
+                          key=lambda i: i.width + i.height, reverse=True)
+        return best_favicon(favicons)
     except Exception:
         logger.exception("error fetching favicon: %s", url)
         return
 
+
+class LRUCache:
+    """
+    A mapping that holds up to `max_size` items, evicting the least recently used one
+    when adding an item beyond that.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = {}
+
+    def get(self, key, default=None):
+        if key not in self.items:
+            return default
+
+        # move the key to the end, so it's the last to be evicted
+        value = self.items.pop(key)
+        self.items[key] = value
+        return value
+
+    def set(self, key, value):
+        self.items.pop(key, None)
+        if len(self.items) >= self.max_size:
+            # dicts keep insertion order, so the first key is the least recently used
+            del self.items[next(iter(self.items))]
+        self.items[key] = value
+
+
+# favicons found by site url, shared across feeds.
+# sites without a favicon aren't cached, so they are probed again next time
+_site_favicons = LRUCache(max_size=512)
+
+
+def fetch_site_favicon(site_url):
+    """
+    Probe the given site for favicons and return the best one, or None.
+    Found icons are cached for the process lifetime, since they rarely change and
+    many feeds can share the same site. Errors are raised, so they aren't cached.
+    """
+    icon_url = _site_favicons.get(site_url)
+    if icon_url:
+        return icon_url
+
+    favicons = favicon.get(site_url, headers={'User-Agent': USER_AGENT}, timeout=2)
+    icon_url = best_favicon(favicons)
+    if icon_url:
+        _site_favicons.set(site_url, icon_url)
+    return icon_url
+
+
+def best_favicon(favicons):
     # if there's an .ico one, prefer it since it's more likely to be
     # a square icon rather than a banner
     ico_format = [f for f in favicons if f.format == 'ico']
@@ -41,6 +94,34 @@ def get_favicon(url, html=None):
     return favicons[0].url if favicons else None
 
 
+# results of url_ok checks shared across feed syncs, as url -> (ok, checked at) pairs
+URL_CHECK_TTL_SECONDS = 24 * 60 * 60
+# failures may be transient (e.g. a 503), so they are re-checked sooner
+URL_CHECK_FAILED_TTL_SECONDS = 10 * 60
+_url_checks = LRUCache(max_size=10000)
+
+
+def url_ok(url):
+    """
+    Return whether a GET to the given url is successful. Successful checks are cached for a day,
+    since this is intended to validate urls that rarely change, like icons.
+    """
+    now = time.monotonic()
+    check = _url_checks.get(url)
+    if check:
+        ok, checked_at = check
+        ttl = URL_CHECK_TTL_SECONDS if ok else URL_CHECK_FAILED_TTL_SECONDS
+        if now - checked_at < ttl:
+            return ok
+
+    # stream to skip downloading the body, since only the status is needed
+    with requests.get(url, stream=True) as response:
+        ok = response.ok
+
+    _url_checks.set(url, (ok, now))
+    return ok
+
+
 class CachingRequestsMixin:
     """
     Exposes a request method that caches the response contents for subsequent requests.
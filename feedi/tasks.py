@@ -77,11 +77,18 @@ def sync_all_feeds():
             app.logger.exception("failure during async task %s", name)
             continue
 
+    # the ranks of the synced feeds are already up to date, but the rest need to be recomputed as well
+    # since the ranking depends on the current date
+    models.Feed.update_frequency_ranks()
+    db.session.commit()
+
 
 @huey_task()
 def sync_feed(feed_id, _feed_name, force=False):
     db_feed = db.session.get(models.Feed, feed_id)
     db_feed.sync_with_remote(force=force)
+    db.session.flush()
+    models.Feed.update_frequency_ranks(feed_id)
     db.session.commit()
 
 
@@ -95,8 +102,11 @@ def content_prefetch():
         query = models.Entry.sorted_by(
             user_id, models.Entry.ORDER_FREQUENCY, start_at, hide_seen=True) \
             .filter(models.Entry.content_full.is_(None), models.Entry.content_url.isnot(None))\
+            .options(sa.orm.undefer(models.Entry.content_full))\
             .limit(15)
 
+        # content_full is known to be empty here, undeferring it saves fetch_content
+        # from lazy loading it with an extra query for each entry
         for entry in db.session.scalars(query):
             app.logger.debug('Prefetching %s', entry.content_url)
             entry.fetch_content()
@@ -114,46 +124,37 @@ def delete_old_entries():
     older_than_date = (datetime.datetime.utcnow() -
                        datetime.timedelta(days=app.config['DELETE_AFTER_DAYS']))
     minimum = app.config['RSS_MINIMUM_ENTRY_AMOUNT']
-    # there must be more clever sql ways to do this, but it doesn't have to be efficient
 
-    # filter feeds that have old entries
-    feeds_q = db.select(models.Feed.id, models.Feed.name)\
-        .join(models.Feed.entries)\
-        .filter(models.Entry.sort_date < older_than_date,
-                models.Entry.favorited.is_(None),
+    # get the date of the nth entry of each feed (overall, not just within the old ones)
+    ranked_entries = db.select(
+        models.Entry.feed_id,
+        models.Entry.sort_date,
+        sa.func.row_number().over(partition_by=models.Entry.feed_id,
+                                  order_by=models.Entry.sort_date.desc()).label('position'))\
+        .filter(models.Entry.feed_id.isnot(None))\
+        .subquery()
+    min_sort_dates = db.select(ranked_entries.c.feed_id, ranked_entries.c.sort_date)\
+        .filter(ranked_entries.c.position == minimum)\
+        .subquery()
+
+    # delete all feed entries that are older than DELETE_AFTER_DAYS
+    # AND ALSO older than the nth entry of their feed, so we guarantee to always keep at least the minimum.
+    # feeds with less than the minimum entries don't have an nth date so they are skipped by the join
+    old_entry_ids = db.select(models.Entry.id)\
+        .join(min_sort_dates, models.Entry.feed_id == min_sort_dates.c.feed_id)\
+        .filter(models.Entry.favorited.is_(None),
                 models.Entry.sent_to_kindle.is_(None),
-                models.Entry.pinned.is_(None)
-                )\
-        .group_by(models.Feed.id)\
-        .having(sa.func.count(models.Feed.entries) > 0)
-
-    for (feed_id, feed_name) in db.session.execute(feeds_q).all():
-        # of the ones that have old entries, get the date of the nth entry (overall, not just within the old ones)
-        min_sort_date = db.session.scalar(
-            db.select(models.Entry.sort_date)
-            .filter_by(feed_id=feed_id)
-            .order_by(models.Entry.sort_date.desc())
-            .limit(1)
-            .offset(minimum - 1))
-
-        if not min_sort_date:
-            continue
+                models.Entry.pinned.is_(None),
+                models.Entry.sort_date < min_sort_dates.c.sort_date,
+                models.Entry.sort_date < older_than_date)
 
-        # delete all entries from that feed that are older than RSS_SKIP_OLDER_THAN_DAYS
-        # AND ALSO older than the nth entry, so we guarantee to always keep at least the minimum
-        q = db.delete(models.Entry)\
-              .where(
-                  models.Entry.favorited.is_(None),
-                  models.Entry.sent_to_kindle.is_(None),
-                  models.Entry.pinned.is_(None),
-                  models.Entry.feed_id == feed_id,
-                  models.Entry.sort_date < min_sort_date,
-                  models.Entry.sort_date < older_than_date)
-
-        res = db.session.execute(q)
-        db.session.commit()
-        if res.rowcount:
-            app.logger.info("Deleted %s old entries from %s/%s", res.rowcount, feed_id, feed_name)
+    q = db.delete(models.Entry)\
+        .where(models.Entry.id.in_(old_entry_ids))
+
+    res = db.session.execute(q)
+    db.session.commit()
+    if res.rowcount:
+        app.logger.info("Deleted %s old feed entries", res.rowcount)
 
     # Delete old standalone entries (without associated feed)
     q = db.delete(models.Entry)\
@@ -198,13 +199,14 @@ def load_user_arg(_ctx, _param, email):
 def csv_load(file, user):
     "Load feeds from a local csv file."
 
+    existing_names = user_feed_names(user)
     with open(file) as csv_file:
         for values in csv.reader(csv_file):
 
             cls = models.Feed.resolve(values[0])
             feed = cls.from_valuelist(*values)
             feed.user_id = user.id
-            add_if_not_exists(feed)
+            add_if_not_exists(feed, existing_names)
 
 
 @feed_cli.command('dump')
@@ -226,6 +228,7 @@ def csv_dump(file, user):
 @click.argument('user', required=False, callback=load_user_arg)
 def opml_load(file, user):
     document = opml.OpmlDocument.load(file)
+    existing_names = user_feed_names(user)
 
     for outline in document.outlines:
         if outline.outlines:
@@ -235,13 +238,15 @@ def opml_load(file, user):
                 add_if_not_exists(models.RssFeed(name=feed.title or feed.text,
                                                  user_id=user.id,
                                                  url=feed.xml_url,
-                                                 folder=folder))
+                                                 folder=folder),
+                                  existing_names)
 
         else:
             # it's a top-level feed
             add_if_not_exists(models.RssFeed(name=feed.title or feed.text,
                                              user_id=user.id,
-                                             url=feed.xml_url))
+                                             url=feed.xml_url),
+                              existing_names)
 
 
 @feed_cli.command('dump-opml')
@@ -271,12 +276,20 @@ def opml_dump(file, user):
     document.dump(file)
 
 
-def add_if_not_exists(feed):
-    query = db.select(db.exists(models.Feed)
-                      .where(models.Feed.name == feed.name, models.Feed.user_id == feed.user_id))
-    if db.session.execute(query).scalar():
+def user_feed_names(user):
+    "Return the set of feed names of the given user, to check for existence before adding feeds in bulk."
+    return set(db.session.scalars(db.select(models.Feed.name).filter_by(user_id=user.id)))
+
+
+def add_if_not_exists(feed, existing_names):
+    """
+    Add the feed unless there's already one with the same name in the given `existing_names` set,
+    which is updated accordingly.
+    """
+    if feed.name in existing_names:
         app.logger.info('skipping already existent %s', feed.name)
         return
+    existing_names.add(feed.name)
 
     db.session.add(feed)
     db.session.commit()
@@ -0,0 +1,27 @@
+"""add entry feed sort index
+
+Revision ID: c3a5d8e1f2b4
+Revises: 85eecf551f0e
+Create Date: 2026-10-15 10:52:31.402113
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3a5d8e1f2b4'
+down_revision: Union[str, None] = '85eecf551f0e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('entries', schema=None) as batch_op:
+        batch_op.create_index('entry_feed_sort_ts', ['feed_id', sa.text('sort_date DESC')], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('entries', schema=None) as batch_op:
+        batch_op.drop_index('entry_feed_sort_ts')
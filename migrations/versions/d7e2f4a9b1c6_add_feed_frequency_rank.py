@@ -0,0 +1,50 @@
+"""add feed frequency rank
+
+Revision ID: d7e2f4a9b1c6
+Revises: c3a5d8e1f2b4
+Create Date: 2026-10-15 11:02:47.315820
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7e2f4a9b1c6'
+down_revision: Union[str, None] = 'c3a5d8e1f2b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# the default DELETE_AFTER_DAYS, since the app config is not available to migrations
+RETENTION_DAYS = 7
+
+
+def upgrade() -> None:
+    op.add_column('feeds', sa.Column('frequency_rank', sa.Integer(), nullable=True))
+
+    # backfill the ranks the same way as Feed.update_frequency_ranks does on sync,
+    # otherwise the frequency ordering would fall back to recency until the next sync.
+    # feeds without recent entries are left without a rank
+    daily_entries = f"""CAST(count(entries.id) AS REAL) /
+        (1 + min({RETENTION_DAYS}, round(julianday('now') - julianday(feeds.created))))"""
+    op.execute(f"""
+        UPDATE feeds SET frequency_rank = (
+            SELECT CASE
+                WHEN {daily_entries} < 1.0 / 30 THEN 0
+                WHEN {daily_entries} < 1.0 / 7 THEN 1
+                WHEN {daily_entries} < 1 THEN 2
+                WHEN {daily_entries} < 5 THEN 3
+                WHEN {daily_entries} < 20 THEN 4
+                ELSE 5
+            END
+            FROM entries
+            WHERE entries.feed_id = feeds.id
+              AND entries.sort_date >= datetime('now', '-{RETENTION_DAYS} days')
+            HAVING count(entries.id) > 0)
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column('feeds', 'frequency_rank')
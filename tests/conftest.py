@@ -61,7 +61,7 @@ def create_feed(client, domain, items, folder=None):
     }, follow_redirects=True)
 
 
-def mock_feed(domain, items):
+def mock_feed(domain, items, headers=None):
     base_url = f'http://{domain}'
     feed_url = f'{base_url}/feed'
 
@@ -87,16 +87,15 @@ def mock_feed(domain, items):
     rssfeed = fg.rss_str()
     mock_request(base_url)
     mock_request(f'{base_url}/favicon.ico', ctype='image/x-icon')
-    mock_request(feed_url, body=rssfeed, ctype='application/rss+xml')
+    mock_request(feed_url, body=rssfeed, ctype='application/rss+xml', headers=headers)
 
     return feed_url
 
 
-def mock_request(url, body='', ctype='application/html'):
-    httpretty.register_uri(httpretty.HEAD, url, adding_headers={
-                           'Content-Type': ctype}, priority=1)
-    httpretty.register_uri(httpretty.GET, url, body=body, adding_headers={
-                           'Content-Type': ctype}, priority=1)
+def mock_request(url, body='', ctype='application/html', headers=None):
+    headers = {'Content-Type': ctype, **(headers or {})}
+    httpretty.register_uri(httpretty.HEAD, url, adding_headers=headers, priority=1)
+    httpretty.register_uri(httpretty.GET, url, body=body, adding_headers=headers, priority=1)
 
 
 def extract_entry_ids(response):
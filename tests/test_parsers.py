@@ -0,0 +1,25 @@
+# coding: utf-8
+
+import pytest
+from feedi.parsers import rss
+
+
+@pytest.mark.parametrize('url, parser_cls', [
+    ('https://old.reddit.com/r/python/.rss', rss.RedditParser),
+    ('https://www.reddit.com/message/inbox/.rss?feed=abc', rss.RedditInboxParser),
+    ('https://hnrss.org/frontpage', rss.HackerNewsParser),
+    ('https://lobste.rs:443/rss', rss.LobstersParser),
+    ('https://user@lobste.rs/rss', rss.LobstersParser),
+    ('https://example.com/reddit.com/feed', rss.RSSParser),
+    ('https://example.com/feed', rss.RSSParser),
+])
+def test_resolve_rss_parser(url, parser_cls):
+    assert rss.RSSParser.resolve(url) is parser_cls
+
+
+def test_rss_parser_requires_domains():
+    with pytest.raises(TypeError):
+        class NoDomainsParser(rss.RSSParser):
+            @staticmethod
+            def is_compatible(feed_url):
+                return 'example.com' in feed_url
@@ -3,6 +3,9 @@
 import datetime as dt
 import re
 
+import feedi.models as models
+import httpretty
+from feedi.models import db
 from tests.conftest import (create_feed, extract_entry_ids, mock_feed,
                             mock_request)
 
@@ -136,13 +139,27 @@ def test_home_pagination(app, client):
     assert f'f1-a{per_page}' not in response.text
 
 
-def test_sync_old_entries(client):
-    # TODO
-    # verify that RSS_SKIP_OLDER_THAN_DAYS is honored
-
-    # verify that if the feed doesn't have enough entries
-    # RSS_MINIMUM_ENTRY_AMOUNT is honored, regardless of entry age
-    pass
+def test_sync_old_entries(app, client):
+    now = dt.datetime.now(dt.timezone.utc)
+    minimum = app.config['RSS_MINIMUM_ENTRY_AMOUNT']
+    old_date = now - dt.timedelta(days=app.config['RSS_SKIP_OLDER_THAN_DAYS'] + 1)
+    recent_titles = ['recent-a0', 'recent-a1']
+    old_titles = [f'old-a{i}' for i in range(minimum * 4)]
+    items = [{'title': title, 'date': now - dt.timedelta(hours=i)} for i, title in enumerate(recent_titles)]
+    items += [{'title': title, 'date': old_date - dt.timedelta(hours=i)} for i, title in enumerate(old_titles)]
+    # feedgen prepends the entries, so they are reversed to get them in this order in the feed
+    response = create_feed(client, 'oldfeed1.com', items[::-1])
+
+    # on first load, the feed doesn't have enough recent entries
+    # so old ones are included up to RSS_MINIMUM_ENTRY_AMOUNT
+    expected = recent_titles + old_titles[:minimum - len(recent_titles)]
+    for title in expected:
+        assert title in response.text
+    assert old_titles[minimum - len(recent_titles)] not in response.text
+
+    # verify that the old entries that weren't needed weren't parsed, i.e. their articles not requested
+    requested = {request.path.strip('/') for request in httpretty.latest_requests()}
+    assert requested & set(recent_titles + old_titles) == set(expected)
 
 
 def test_sync_updates(client):
@@ -173,6 +190,71 @@ def test_sync_updates(client):
     assert 'my-third-article' in response.text
 
 
+def test_sync_keeps_prefetched_content(app, client):
+    feed_domain = 'feed1.com'
+    response = create_feed(client, feed_domain, [{'title': 'my-first-article', 'date': '2023-10-01 00:00Z'}])
+    entry_id = int(extract_entry_ids(response)[0])
+
+    # simulate the content being prefetched after the first sync
+    with app.app_context():
+        entry = db.session.get(models.Entry, entry_id)
+        entry.content_full = '<p>prefetched content</p>'
+        db.session.commit()
+        updated = entry.updated
+
+    # force resync with the feed unchanged
+    response = client.post(f'/feeds/{feed_domain}/entries')
+    assert response.status_code == 200
+
+    # verify the row wasn't rewritten and the content was kept
+    with app.app_context():
+        entry = db.session.get(models.Entry, entry_id)
+        assert entry.content_full == '<p>prefetched content</p>'
+        assert entry.updated == updated
+
+
+def test_sync_unchanged_feed(app, client):
+    from feedi import tasks
+
+    feed_domain = 'etag1.com'
+    items = [{'title': 'my-first-article', 'date': '2023-10-01 00:00Z'},
+             {'title': 'my-second-article', 'date': '2023-10-10 00:00Z'}]
+    create_feed(client, feed_domain, items)
+
+    # resync to get the conditional GET headers
+    etag = '"v1"'
+    modified = 'Tue, 10 Oct 2023 00:00:00 GMT'
+    feed_url = mock_feed(feed_domain, items, headers={'ETag': etag, 'Last-Modified': modified})
+    response = client.post(f'/feeds/{feed_domain}/entries')
+    assert response.status_code == 200
+
+    def feed_state():
+        feed = db.session.scalar(db.select(models.RssFeed).filter_by(url=feed_url))
+        entries = db.session.execute(db.select(models.Entry.id, models.Entry.updated)
+                                     .filter_by(feed_id=feed.id).order_by(models.Entry.id)).all()
+        return feed, entries
+
+    # the feed is not modified since, and it wasn't synced recently
+    httpretty.register_uri(httpretty.GET, feed_url, status=304, priority=2)
+    with app.app_context():
+        feed, entries = feed_state()
+        assert feed.etag == etag
+        assert feed.modified_header == modified
+        feed.last_fetch = dt.datetime.utcnow() - dt.timedelta(days=1)
+        db.session.commit()
+        feed_id = feed.id
+
+    tasks.sync_feed(feed_id, feed_domain).get()
+
+    # verify the headers are kept for the next sync and the entries weren't touched
+    assert httpretty.last_request().headers['If-None-Match'] == etag
+    with app.app_context():
+        feed, new_entries = feed_state()
+        assert feed.etag == etag
+        assert feed.modified_header == modified
+        assert new_entries == entries
+
+
 def test_sync_between_pages(client):
     # TODO verify pagination behaves reasonably if new feeds/entries
     # are added between fetching one page and the next
@@ -354,6 +436,52 @@ def test_feed_delete(client):
     assert 'plain-entry' not in response.text
 
 
+def test_purge_old_entries(app, client):
+    now = dt.datetime.now(dt.timezone.utc)
+    minimum = app.config['RSS_MINIMUM_ENTRY_AMOUNT']
+    big_feed_titles = [f'p1-a{i}' for i in range(minimum + 3)]
+    small_feed_titles = [f'p2-a{i}' for i in range(minimum - 2)]
+    create_feed(client, 'purge1.com', [{'title': title, 'date': now - dt.timedelta(hours=i)}
+                                       for i, title in enumerate(big_feed_titles)])
+    create_feed(client, 'purge2.com', [{'title': title, 'date': now - dt.timedelta(hours=i)}
+                                       for i, title in enumerate(small_feed_titles)])
+
+    def entry_ids_by_url():
+        return dict(db.session.execute(
+            db.select(models.Entry.content_url, models.Entry.id)
+            .filter(models.Entry.content_url.like('http://purge%'))).all())
+
+    # make all entries older than the deletion threshold
+    with app.app_context():
+        older = dt.timedelta(days=app.config['DELETE_AFTER_DAYS'] + 1)
+        for entry in db.session.scalars(db.select(models.Entry)
+                                        .filter(models.Entry.content_url.like('http://purge%'))):
+            entry.sort_date -= older
+        db.session.commit()
+        entry_ids = entry_ids_by_url()
+
+    # fav and pin the two oldest entries of the big feed
+    response = client.put(f'/favorites/{entry_ids["http://purge1.com/" + big_feed_titles[-2]]}')
+    assert response.status_code == 204
+    response = client.put(f'/pinned/{entry_ids["http://purge1.com/" + big_feed_titles[-1]]}')
+    assert response.status_code == 200
+
+    result = app.test_cli_runner().invoke(args=['feed', 'purge'])
+    assert result.exit_code == 0
+
+    with app.app_context():
+        remaining = entry_ids_by_url()
+
+    # the big feed keeps the minimum amount plus the favorited and pinned entries
+    expected = big_feed_titles[:minimum] + big_feed_titles[-2:]
+    assert sorted(url for url in remaining if 'purge1.com' in url) == \
+        sorted(f'http://purge1.com/{title}' for title in expected)
+
+    # feeds with less than the minimum keep all their entries
+    assert sorted(url for url in remaining if 'purge2.com' in url) == \
+        sorted(f'http://purge2.com/{title}' for title in small_feed_titles)
+
+
 def test_mastodon_feed(client):
     # TODO mock mastodon api requests
     # check that entries show up in feed